@@ -1,44 +1,87 @@
 import streamlit as st
 import boto3
+import pandas as pd
 import uuid
-from datetime import datetime
 import time
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
 
-# AWS認証情報の初期化
+# 会話メタデータ用のGSI名とエンティティ種別
+CONVERSATION_INDEX_NAME = 'ConvIndex'
+CONVERSATION_ENTITY_TYPE = 'CONV'
+# 会話メタデータアイテムのソートキー（メッセージのタイムスタンプと衝突しない値）
+CONVERSATION_META_TIMESTAMP = 0
+# 会話メタデータ用GSIの定義（テーブル作成時と既存テーブルへの追加時に共通で使用）
+CONVERSATION_INDEX_ATTRIBUTE_DEFINITIONS = [
+    {'AttributeName': 'entity_type', 'AttributeType': 'S'},
+    {'AttributeName': 'created_at', 'AttributeType': 'N'}
+]
+CONVERSATION_INDEX = {
+    # 会話ごとに1件のメタデータアイテムのみが載る疎なインデックス
+    'IndexName': CONVERSATION_INDEX_NAME,
+    'KeySchema': [
+        {'AttributeName': 'entity_type', 'KeyType': 'HASH'},
+        {'AttributeName': 'created_at', 'KeyType': 'RANGE'}
+    ],
+    'Projection': {'ProjectionType': 'KEYS_ONLY'},
+    'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+}
+# 会話メタデータ用GSIが利用可能になるまでの最大待機時間（秒）
+CONVERSATION_INDEX_WAIT_SECONDS = 15 * 60
+# 論理削除したメッセージをTTLで自動的に完全削除するまでの猶予期間（秒）
+DELETE_GRACE_PERIOD_SECONDS = 7 * 24 * 60 * 60
+# 送信者ごとの表示名
+SENDER_LABELS = {
+    'user': "ユーザー",
+    'support': "サポート担当者",
+    'bot': "自動応答ボット"
+}
+
+# AWS認証情報の初期化（再実行のたびに接続を作り直さないようプロセス内でキャッシュ）
+# 失敗した場合は例外を送出し、失敗結果がキャッシュされないようにする
+@st.cache_resource
 def initialize_aws():
-    try:
-        # Streamlit Cloudのシークレットから認証情報を取得
-        aws_access_key_id = st.secrets["aws"]["AWS_ACCESS_KEY"]
-        aws_secret_access_key = st.secrets["aws"]["AWS_SECRET_KEY"]
-        region_name = st.secrets["aws"]["AWS_REGION"]
-        table_name = st.secrets["aws"]["TABLE_NAME"]
-        
-        # セッションの作成
-        session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-        )
-        
-        # DynamoDBリソースの作成（AWSのDynamoDBに接続）
-        dynamodb = session.resource('dynamodb')
-        
-        return dynamodb, table_name
-    except Exception as e:
-        st.error(f"AWS認証情報の取得に失敗しました: {e}")
-        return None, None
+    # Streamlit Cloudのシークレットから認証情報を取得
+    # （st.cache_resourceによりプロセスごとに1回のみ実行される。app.pyはStreamlitの
+    # 再実行のたびにモジュール全体が評価されるため、モジュール直下には置かない）
+    cfg = st.secrets["aws"]
+    aws_access_key_id = cfg["AWS_ACCESS_KEY"]
+    aws_secret_access_key = cfg["AWS_SECRET_KEY"]
+    region_name = cfg["AWS_REGION"]
+    table_name = cfg["TABLE_NAME"]
+    
+    # セッションの作成
+    session = boto3.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        region_name=region_name
+    )
+    
+    # DynamoDBリソースの作成（AWSのDynamoDBに接続）
+    dynamodb = session.resource('dynamodb')
+    # 頻繁に呼ばれる読み書き用の低レベルクライアント（Resourceの型変換を経由しない）
+    client = session.client('dynamodb')
+    
+    return dynamodb, client, table_name
 
 # DynamoDBテーブルの作成（存在しない場合）
-def create_table_if_not_exists(dynamodb, table_name):
+# _dynamodbと_clientはハッシュ化できないため、先頭のアンダースコアでキャッシュキーから除外する
+@st.cache_resource
+def create_table_if_not_exists(_dynamodb, _client, table_name):
+    # テーブルが存在するか確認（ListTablesではなくDescribeTable 1回で判定）
+    table = _dynamodb.Table(table_name)
+    try:
+        table.load()
+        # 会話メタデータ用GSIやTTLの設定がない古いテーブルを移行
+        migrate_conversation_index(_client, table)
+        enable_message_ttl(_client, table_name)
+        return table
+    except _dynamodb.meta.client.exceptions.ResourceNotFoundException:
+        pass
+    
     try:
-        # テーブルが存在するか確認
-        existing_tables = [table.name for table in dynamodb.tables.all()]
-        if table_name in existing_tables:
-            return dynamodb.Table(table_name)
-        
         # テーブルが存在しない場合は作成
-        table = dynamodb.create_table(
+        table = _dynamodb.create_table(
             TableName=table_name,
             KeySchema=[
                 {'AttributeName': 'conversation_id', 'KeyType': 'HASH'},  # パーティションキー
@@ -47,99 +90,314 @@ def create_table_if_not_exists(dynamodb, table_name):
             AttributeDefinitions=[
                 {'AttributeName': 'conversation_id', 'AttributeType': 'S'},
                 {'AttributeName': 'timestamp', 'AttributeType': 'N'}
-            ],
+            ] + CONVERSATION_INDEX_ATTRIBUTE_DEFINITIONS,
+            GlobalSecondaryIndexes=[CONVERSATION_INDEX],
             ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
         )
         # テーブルが作成されるまで待機
         table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
-        st.success("DynamoDBテーブルが作成されました！")
+        enable_message_ttl(_client, table_name)
+        print("DynamoDBテーブルが作成されました！")
         return table
-    except Exception as e:
-        # テーブルが既に存在する場合など
-        print(f"テーブル作成中のエラー（既に存在する場合は無視してください）: {e}")
-        return dynamodb.Table(table_name)
+    except _dynamodb.meta.client.exceptions.ResourceInUseException:
+        # 別のプロセスが先にテーブルを作成した場合のみ既存テーブルを使用
+        # それ以外のエラーは送出し、存在しないテーブルのハンドルがキャッシュされないようにする
+        table = _dynamodb.Table(table_name)
+        table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+        return table
+
+# 論理削除したメッセージがTTLで自動的に完全削除されるよう設定（未設定の場合のみ）
+# TTLはバックグラウンドでの削除のみに使用するため、設定に失敗しても起動は継続する
+def enable_message_ttl(client, table_name):
+    try:
+        description = client.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+        status = description['TimeToLiveStatus']
+        if status == 'DISABLING':
+            # 無効化の完了前は再設定できないため、次回起動時に再度設定する
+            print("TTLの無効化処理中のため、削除済みメッセージの自動削除は設定されていません")
+            return
+        if status in ('ENABLED', 'ENABLING'):
+            if description.get('AttributeName') != 'ttl_delete_at':
+                # TTL属性はテーブルごとに1つのみのため、他の属性で設定済みの場合は変更しない
+                print(f"TTLが別の属性（{description.get('AttributeName')}）で設定されているため、削除済みメッセージは自動削除されません")
+            return
+        client.update_time_to_live(
+            TableName=table_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'ttl_delete_at'}
+        )
+    except ClientError as e:
+        print(f"TTLの設定に失敗したため、削除済みメッセージは自動削除されません: {e}")
 
-# メッセージをDynamoDBに保存
-def save_message(table, conversation_id, sender, message):
-    timestamp = int(time.time() * 1000)  # ミリ秒タイムスタンプ
+# 会話メタデータ用GSIがない既存テーブルに、メタデータを補完してからGSIを追加（一度きりの移行処理）
+def migrate_conversation_index(client, table):
+    indexes = table.global_secondary_indexes or []
+    if any(index['IndexName'] == CONVERSATION_INDEX_NAME for index in indexes):
+        return
+    
+    # 既存メッセージから会話ごとの最初のタイムスタンプを集計
+    first_timestamps = {}
+    scan_kwargs = {
+        'ProjectionExpression': 'conversation_id, #ts',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'}
+    }
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response['Items']:
+            timestamp = int(item['timestamp'])
+            if timestamp == CONVERSATION_META_TIMESTAMP:
+                continue
+            conversation_id = item['conversation_id']
+            first_timestamps[conversation_id] = min(first_timestamps.get(conversation_id, timestamp), timestamp)
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    # GSIより先にメタデータを書き込むことで、途中で失敗しても次回起動時に再実行される
+    for conversation_id, timestamp in first_timestamps.items():
+        save_conversation_metadata(client, table.name, conversation_id, timestamp)
     
-    response = table.put_item(
+    # オンデマンドキャパシティのテーブルではGSIにスループットを指定できない
+    index = dict(CONVERSATION_INDEX)
+    if (table.billing_mode_summary or {}).get('BillingMode') == 'PAY_PER_REQUEST':
+        del index['ProvisionedThroughput']
+    client.update_table(
+        TableName=table.name,
+        AttributeDefinitions=CONVERSATION_INDEX_ATTRIBUTE_DEFINITIONS,
+        GlobalSecondaryIndexUpdates=[{'Create': index}]
+    )
+    
+    # GSIが利用可能になるまで待機（期限を過ぎた場合は例外を送出し、失敗がキャッシュされないようにする）
+    deadline = time.monotonic() + CONVERSATION_INDEX_WAIT_SECONDS
+    while True:
+        time.sleep(5)
+        table.reload()
+        statuses = [index['IndexStatus'] for index in table.global_secondary_indexes or []
+                    if index['IndexName'] == CONVERSATION_INDEX_NAME]
+        if statuses == ['ACTIVE']:
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"会話メタデータ用のGSI（{CONVERSATION_INDEX_NAME}）が利用可能になりませんでした: {statuses}")
+    print("会話メタデータ用のGSIを追加しました")
+
+# 会話メタデータを保存（既に存在する場合は条件付き書き込みにより何もしない）
+def save_conversation_metadata(client, table_name, conversation_id, timestamp):
+    try:
+        client.put_item(
+            TableName=table_name,
+            Item={
+                'conversation_id': {'S': conversation_id},
+                'timestamp': {'N': str(CONVERSATION_META_TIMESTAMP)},
+                'entity_type': {'S': CONVERSATION_ENTITY_TYPE},
+                'created_at': {'N': str(timestamp)}
+            },
+            ConditionExpression="attribute_not_exists(conversation_id)"
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        # 既にメタデータが存在する場合は何もしない
+        pass
+
+# ミリ秒タイムスタンプを表示用の日時文字列に変換
+def format_timestamp(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(timestamp) // 1000))
+
+# 低レベルクライアントが返す型付きアイテムを表示用の辞書に変換
+def parse_message_item(item):
+    message = {
+        'timestamp': int(item['timestamp']['N']),
+        'sender': item['sender']['S'],
+        'message': item['message']['S']
+    }
+    if 'ttl_delete_at' in item:
+        message['ttl_delete_at'] = int(item['ttl_delete_at']['N'])
+    if 'is_deleted' in item:
+        message['is_deleted'] = item['is_deleted']['BOOL']
+    return message
+
+# メッセージが削除済みかどうかを判定
+# TTL導入前に論理削除されたメッセージはis_deletedフラグのみを持つため、両方を確認する
+def is_deleted_message(message):
+    return 'ttl_delete_at' in message or message.get('is_deleted', False)
+
+# メッセージをDynamoDBに保存（低レベルクライアントで型付きのアイテムを直接書き込む）
+def save_message(client, table_name, conversation_id, sender, message):
+    timestamp = time.time_ns() // 1_000_000  # ミリ秒タイムスタンプ
+    
+    # このセッションで既にメタデータを書き込んだ（または存在を確認した）会話では書き込みを省略
+    conversations_with_metadata = st.session_state.setdefault('conversations_with_metadata', set())
+    if conversation_id not in conversations_with_metadata:
+        save_conversation_metadata(client, table_name, conversation_id, timestamp)
+        conversations_with_metadata.add(conversation_id)
+    
+    client.put_item(
+        TableName=table_name,
         Item={
-            'conversation_id': conversation_id,
-            'timestamp': timestamp,
-            'sender': sender,
-            'message': message,
-            'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'is_deleted': False  # 削除フラグを追加
+            'conversation_id': {'S': conversation_id},
+            'timestamp': {'N': str(timestamp)},
+            'sender': {'S': sender},
+            'message': {'S': message}
         }
     )
-    return response
+    get_conversation_history.clear()
 
 # DynamoDBからメッセージを削除（論理削除）
+# 猶予期間の経過後、DynamoDBのTTLにより自動的に完全削除される
 def delete_message(table, conversation_id, timestamp):
-    response = table.update_item(
+    table.update_item(
         Key={
             'conversation_id': conversation_id,
             'timestamp': timestamp
         },
-        UpdateExpression="SET is_deleted = :val",
+        UpdateExpression="SET ttl_delete_at = :val",
         ExpressionAttributeValues={
-            ':val': True
+            ':val': int(time.time()) + DELETE_GRACE_PERIOD_SECONDS
         },
-        ReturnValues="UPDATED_NEW"
+        ReturnValues="NONE"  # 更新後の値は使用しないため返却させない
     )
-    return response
+    get_conversation_history.clear()
 
 # メッセージを物理的に削除
 def physically_delete_message(table, conversation_id, timestamp):
-    response = table.delete_item(
+    table.delete_item(
         Key={
             'conversation_id': conversation_id,
             'timestamp': timestamp
         }
     )
-    return response
+    get_conversation_history.clear()
 
-# 会話履歴を取得（削除済みのメッセージを含むかどうかのオプション付き）
-def get_conversation_history(table, conversation_id, include_deleted=False):
-    response = table.query(
-        KeyConditionExpression=Key('conversation_id').eq(conversation_id),
-        ScanIndexForward=True  # タイムスタンプの昇順で取得
-    )
+# 複数のメッセージをまとめて物理的に削除（BatchWriteItemで最大25件ずつ送信）
+def physically_delete_messages(table, conversation_id, timestamps):
+    with table.batch_writer() as batch:
+        for timestamp in timestamps:
+            batch.delete_item(
+                Key={
+                    'conversation_id': conversation_id,
+                    'timestamp': timestamp
+                }
+            )
+    get_conversation_history.clear()
+
+# 会話内の削除済みメッセージのタイムスタンプをすべて取得
+def get_deleted_message_timestamps(table, conversation_id):
+    query_kwargs = {
+        'KeyConditionExpression': Key('conversation_id').eq(conversation_id) & Key('timestamp').gt(CONVERSATION_META_TIMESTAMP),
+        'FilterExpression': Attr('ttl_delete_at').exists() | Attr('is_deleted').eq(True),
+        'ProjectionExpression': '#ts',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'}
+    }
     
-    if include_deleted:
-        return response['Items']
-    else:
-        # 削除されていないメッセージのみをフィルタリング
-        return [item for item in response['Items'] if not item.get('is_deleted', False)]
+    timestamps = []
+    while True:
+        response = table.query(**query_kwargs)
+        timestamps.extend(item['timestamp'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return timestamps
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
-# すべての会話IDを取得
-def get_all_conversation_ids(table):
-    response = table.scan(
-        ProjectionExpression="conversation_id",
-        Select='SPECIFIC_ATTRIBUTES'
-    )
+# 会話履歴を新しい方から1ページ分取得（削除済みのメッセージを含むかどうかのオプション付き）
+# 戻り値は (古い順に並べたメッセージのリスト, より古いページのカーソル)。最も古いページの場合カーソルはNone
+# 再実行のたびにクエリを発行しないよう結果をキャッシュし、書き込み時にクリアする
+@st.cache_data(ttl=30, show_spinner=False)
+def get_conversation_history(_client, table_name, conversation_id, include_deleted=False, cursor=None, page_size=20):
+    query_kwargs = {
+        'TableName': table_name,
+        # メタデータアイテムを除外するため、タイムスタンプで範囲を絞る
+        'KeyConditionExpression': "conversation_id = :cid AND #ts > :meta_ts",
+        'ExpressionAttributeValues': {
+            ':cid': {'S': conversation_id},
+            ':meta_ts': {'N': str(CONVERSATION_META_TIMESTAMP)}
+        },
+        'ScanIndexForward': False,  # 最新のメッセージから降順で取得
+        'Limit': page_size + 1,  # より古いメッセージの有無を判定するため1件多く取得
+        # 画面表示に必要な属性のみを取得
+        'ProjectionExpression': '#ts, sender, #msg, ttl_delete_at, is_deleted',
+        'ExpressionAttributeNames': {'#ts': 'timestamp', '#msg': 'message'}
+    }
+    if not include_deleted:
+        # 削除されていないメッセージのみをDynamoDB側でフィルタリング
+        # TTL導入前のis_deletedフラグによる論理削除も除外する
+        query_kwargs['FilterExpression'] = (
+            "attribute_not_exists(ttl_delete_at) AND "
+            "(attribute_not_exists(is_deleted) OR is_deleted = :false)"
+        )
+        query_kwargs['ExpressionAttributeValues'][':false'] = {'BOOL': False}
+    if cursor:
+        query_kwargs['ExclusiveStartKey'] = cursor
+    
+    # LimitはFilterExpressionの前に適用されるため、1回のクエリで返る件数はpage_size未満になり得る
+    # より古いメッセージが実際に存在するかを判定するため、page_sizeより1件多く集まるか、
+    # より古いデータがなくなるまで続けて取得する
+    items = []
+    while True:
+        response = _client.query(**query_kwargs)
+        items.extend(response['Items'])
+        if len(items) > page_size or 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    # 次のページは実際に返した最も古いメッセージの直後から取得する
+    # （最後のレスポンスのLastEvaluatedKeyを使うと、読み込んだが返さなかったメッセージが飛ばされる）
+    # LastEvaluatedKeyはLimitに達しただけでも返されるため、カーソルの有無には使わない
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = {'conversation_id': {'S': conversation_id}, 'timestamp': items[-1]['timestamp']}
     
-    # 重複を排除
-    unique_ids = set()
-    for item in response['Items']:
-        unique_ids.add(item['conversation_id'])
+    # 表示用に古い順へ並べ替える
+    messages = [parse_message_item(item) for item in reversed(items)]
+    return messages, next_cursor
+
+# すべての会話IDを取得（作成日時の新しい順）
+def get_all_conversation_ids(table, page_size=100):
+    query_kwargs = {
+        'IndexName': CONVERSATION_INDEX_NAME,
+        'KeyConditionExpression': Key('entity_type').eq(CONVERSATION_ENTITY_TYPE),
+        'ScanIndexForward': False,
+        'Limit': page_size,
+        # 会話IDのみを取得
+        'ProjectionExpression': 'conversation_id'
+    }
     
-    # 最近の会話順にソート（実際の実装ではタイムスタンプが必要）
-    return list(unique_ids)
+    # メタデータアイテムのみが載る疎なインデックスのため、会話IDは重複せず返される
+    conversation_ids = []
+    while True:
+        response = table.query(**query_kwargs)
+        conversation_ids.extend(item['conversation_id'] for item in response['Items'])
+        # 1MB制限などで結果が分割されている場合は続きを取得
+        if 'LastEvaluatedKey' not in response:
+            return conversation_ids
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+# 削除ボタンのコールバック（スクリプトの再実行前に呼び出される）
+def handle_delete_message(table, conversation_id, timestamp):
+    try:
+        delete_message(table, conversation_id, timestamp)
+        st.success("メッセージを削除しました")
+    except Exception as e:
+        st.error(f"メッセージの削除中にエラーが発生しました: {e}")
+
+# 完全削除ボタンのコールバック（サポート担当者のみ）
+def handle_physically_delete_message(table, conversation_id, timestamp):
+    try:
+        physically_delete_message(table, conversation_id, timestamp)
+        st.success("メッセージを完全に削除しました")
+    except Exception as e:
+        st.error(f"メッセージの完全削除中にエラーが発生しました: {e}")
 
 # Streamlitアプリケーションのメイン関数
 def main():
     st.title("Streamlit × DynamoDB 相互入力チャットボット")
     
-    # AWSとDynamoDBの初期化
+    # AWSとDynamoDBの初期化（2回目以降の再実行ではキャッシュ済みのテーブルを使用）
     try:
-        dynamodb, table_name = initialize_aws()
-        if not dynamodb or not table_name:
-            st.error("AWS認証情報が正しく設定されていません。Streamlit Cloudの設定を確認してください。")
-            return
-            
-        table = create_table_if_not_exists(dynamodb, table_name)
+        dynamodb, client, table_name = initialize_aws()
+    except Exception as e:
+        st.error(f"AWS認証情報の取得に失敗しました: {e}")
+        st.error("AWS認証情報が正しく設定されていません。Streamlit Cloudの設定を確認してください。")
+        return
+    
+    try:
+        table = create_table_if_not_exists(dynamodb, client, table_name)
     except Exception as e:
         st.error(f"DynamoDBへの接続中にエラーが発生しました: {e}")
         return
@@ -162,6 +420,7 @@ def main():
                     )
                     if st.button("この会話を開く"):
                         st.session_state.conversation_id = selected_conversation
+                        st.session_state.history_cursor = None
                         st.rerun()
                 else:
                     st.info("会話がまだありません")
@@ -172,6 +431,10 @@ def main():
     if 'conversation_id' not in st.session_state:
         st.session_state.conversation_id = str(uuid.uuid4())
     
+    # 会話履歴の表示ページ（Noneの場合は最新のページ）
+    if 'history_cursor' not in st.session_state:
+        st.session_state.history_cursor = None
+    
     # 現在の会話IDを表示
     st.caption(f"現在の会話ID: {st.session_state.conversation_id}")
     
@@ -179,6 +442,15 @@ def main():
     show_deleted = False
     if user_type == "サポート担当者":
         show_deleted = st.checkbox("削除されたメッセージを表示", value=False)
+        
+        # 会話内の削除済みメッセージを一括で完全削除
+        if show_deleted and st.button("この会話の削除済みメッセージをすべて完全に削除"):
+            try:
+                timestamps = get_deleted_message_timestamps(table, st.session_state.conversation_id)
+                physically_delete_messages(table, st.session_state.conversation_id, timestamps)
+                st.success(f"{len(timestamps)}件のメッセージを完全に削除しました")
+            except Exception as e:
+                st.error(f"メッセージの一括削除中にエラーが発生しました: {e}")
     
     # 入力フォーム - 送信者が誰かによって表示を変更
     with st.form(key="message_form", clear_on_submit=True):
@@ -201,114 +473,120 @@ def main():
         if submit_button and user_input:
             try:
                 # メッセージを保存
-                save_message(table, st.session_state.conversation_id, sender, user_input)
+                save_message(client, table_name, st.session_state.conversation_id, sender, user_input)
+                # 送信したメッセージが見えるよう最新のページに戻す
+                st.session_state.history_cursor = None
                 st.success("メッセージを送信しました")
             except Exception as e:
                 st.error(f"メッセージの保存中にエラーが発生しました: {e}")
     
     # DynamoDBから会話履歴を取得して表示
     try:
-        conversation_history = get_conversation_history(
-            table, 
+        conversation_history, next_cursor = get_conversation_history(
+            client, 
+            table_name, 
             st.session_state.conversation_id, 
-            include_deleted=show_deleted
+            include_deleted=show_deleted,
+            cursor=st.session_state.history_cursor
         )
         
-        # 削除アクションの処理
-        if 'delete_message' in st.session_state and st.session_state.delete_message:
-            try:
-                timestamp = st.session_state.delete_message
-                delete_message(table, st.session_state.conversation_id, timestamp)
-                st.success("メッセージを削除しました")
-                # 状態をリセットしてページを更新
-                st.session_state.delete_message = None
-                st.rerun()
-            except Exception as e:
-                st.error(f"メッセージの削除中にエラーが発生しました: {e}")
-        
-        # 永久削除アクションの処理（サポート担当者のみ）
-        if user_type == "サポート担当者" and 'permanent_delete' in st.session_state and st.session_state.permanent_delete:
-            try:
-                timestamp = st.session_state.permanent_delete
-                physically_delete_message(table, st.session_state.conversation_id, timestamp)
-                st.success("メッセージを完全に削除しました")
-                # 状態をリセットしてページを更新
-                st.session_state.permanent_delete = None
-                st.rerun()
-            except Exception as e:
-                st.error(f"メッセージの完全削除中にエラーが発生しました: {e}")
-        
         with st.container():
             st.subheader("会話履歴")
+            
+            # 履歴はウィジェットを1件ずつ生成せず、1つの表としてまとめて表示
+            history_rows = []
+            deletable_timestamps = []
+            deleted_timestamps = []
+            message_labels = {}
             for message in conversation_history:
                 # メッセージが削除済みかどうかを確認
-                is_deleted = message.get('is_deleted', False)
+                is_deleted = is_deleted_message(message)
                 timestamp = message['timestamp']
+                date_str = format_timestamp(timestamp)
+                sender_label = SENDER_LABELS.get(message['sender'], message['sender'])
+                
+                history_rows.append({
+                    '日時': date_str,
+                    '送信者': sender_label,
+                    'メッセージ': message['message'],
+                    '状態': "削除済み" if is_deleted else ""
+                })
+                message_labels[timestamp] = f"{date_str} {sender_label}: {message['message'][:20]}"
                 
                 # 現在のユーザーがメッセージの送信者と一致するか、サポート担当者かを確認
                 is_own_message = (user_type == "一般ユーザー" and message['sender'] == 'user') or \
                                (user_type == "サポート担当者" and message['sender'] == 'support')
                 
-                # 削除されたメッセージの表示処理
-                if is_deleted and show_deleted:
-                    # 削除済みのメッセージは斜体で表示
-                    st.markdown(f"*削除済みメッセージ ({message['date']})*")
-                    if user_type == "サポート担当者":
-                        # サポート担当者には元のメッセージを表示
-                        st.text_area(
-                            f"元のメッセージ ({message['sender']})", 
-                            value=message['message'], 
-                            disabled=True,
-                            key=f"deleted_{timestamp}"
-                        )
-                        # 完全削除ボタン
-                        if st.button("完全に削除", key=f"permanent_{timestamp}"):
-                            st.session_state.permanent_delete = timestamp
-                            st.rerun()
-                    continue
-                elif is_deleted and not show_deleted:
-                    # 削除済みで表示しない設定の場合はスキップ
-                    continue
-                
-                # 通常のメッセージ表示処理
-                message_container = st.container()
+                if is_deleted:
+                    deleted_timestamps.append(timestamp)
+                elif is_own_message or user_type == "サポート担当者":
+                    # 自分のメッセージか、サポート担当者の場合のみ削除可能
+                    deletable_timestamps.append(timestamp)
+            
+            if history_rows:
+                history_df = pd.DataFrame(history_rows)
+                if not show_deleted:
+                    history_df = history_df.drop(columns=['状態'])
+                st.dataframe(history_df, use_container_width=True, hide_index=True)
+            elif st.session_state.history_cursor is not None:
+                st.info("これより前のメッセージはありません")
+            else:
+                st.info("メッセージはまだありません")
+            
+            # 削除対象を1つのセレクトボックスで選択
+            if deletable_timestamps:
                 col1, col2 = st.columns([5, 1])
-                
                 with col1:
-                    if message['sender'] == 'user':
-                        st.text_input(
-                            f"ユーザー ({message['date']})", 
-                            value=message['message'], 
-                            disabled=True,
-                            key=f"user_{timestamp}"
-                        )
-                    elif message['sender'] == 'support':
-                        st.text_area(
-                            f"サポート担当者 ({message['date']})", 
-                            value=message['message'], 
-                            disabled=True,
-                            key=f"support_{timestamp}"
-                        )
-                    elif message['sender'] == 'bot':
-                        st.text_area(
-                            f"自動応答ボット ({message['date']})", 
-                            value=message['message'], 
-                            disabled=True,
-                            key=f"bot_{timestamp}"
-                        )
-                
-                # 自分のメッセージか、サポート担当者の場合のみ削除ボタンを表示
+                    delete_target = st.selectbox(
+                        "削除するメッセージ:",
+                        deletable_timestamps,
+                        format_func=message_labels.get,
+                        key="delete_target"
+                    )
                 with col2:
-                    if is_own_message or user_type == "サポート担当者":
-                        if st.button("削除", key=f"delete_{timestamp}"):
-                            st.session_state.delete_message = timestamp
-                            st.rerun()
+                    # on_clickで再実行前に削除するため、追加の再実行は不要
+                    st.button(
+                        "削除",
+                        on_click=handle_delete_message,
+                        args=(table, st.session_state.conversation_id, delete_target)
+                    )
+            
+            # 削除済みメッセージの完全削除（サポート担当者のみ）
+            if user_type == "サポート担当者" and show_deleted and deleted_timestamps:
+                col1, col2 = st.columns([5, 1])
+                with col1:
+                    permanent_target = st.selectbox(
+                        "完全に削除するメッセージ:",
+                        deleted_timestamps,
+                        format_func=message_labels.get,
+                        key="permanent_target"
+                    )
+                with col2:
+                    st.button(
+                        "完全に削除",
+                        on_click=handle_physically_delete_message,
+                        args=(table, st.session_state.conversation_id, permanent_target)
+                    )
+            
+            # ページ送り（1回の再実行で取得・表示するのは1ページ分のみ）
+            col1, col2 = st.columns(2)
+            with col1:
+                if next_cursor:
+                    if st.button("以前のメッセージを表示"):
+                        st.session_state.history_cursor = next_cursor
+                        st.rerun()
+            with col2:
+                if st.session_state.history_cursor is not None:
+                    if st.button("最新のメッセージに戻る"):
+                        st.session_state.history_cursor = None
+                        st.rerun()
     except Exception as e:
         st.error(f"会話履歴の取得中にエラーが発生しました: {e}")
     
     # 新しい会話を開始するオプション
     if st.button("新しい会話を開始"):
         st.session_state.conversation_id = str(uuid.uuid4())
+        st.session_state.history_cursor = None
         st.rerun()
     
     # 自動応答ボットの有効/無効を切り替えるオプション（サポート担当者のみ）
@@ -327,7 +605,8 @@ def main():
         - **サポート担当者**: ユーザーの質問に対して返答できます
         - 自分のメッセージは「削除」ボタンで削除できます
         - サポート担当者は全てのメッセージを削除できます
-        - 削除されたメッセージはサポート担当者のみが閲覧可能です
+        - 削除されたメッセージはサポート担当者のみが閲覧可能です（7日後に自動で完全削除されます）
+        - サポート担当者は会話内の削除済みメッセージを一括で完全削除できます
         """)
 
 if __name__ == "__main__":